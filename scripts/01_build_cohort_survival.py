@@ -13,9 +13,35 @@ Repository:
 import argparse
 import json
 import os
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.csv as pa_csv
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+NS_PER_DAY = 86_400 * 1_000_000_000
+# Arrow-backed strings for id columns: contiguous UTF-8 buffers instead of
+# one Python object per cell through merges and CSV writes
+ID_DTYPE = "string[pyarrow]"
+
+SUMMARY_TEMPLATE = """\
+SURVIVAL COHORT BUILD SUMMARY
+==================================================
+
+Dataset snapshot (max purchase_dt): {snapshot_ts}
+Customers with delivered index order: {n_index:,}
+Cohort rows (1 row per customer): {n_cohort:,}
+Event rate (any repurchase observed): {event_rate:.2%}
+Excluded repurchase statuses: {excluded}
+
+Index order definition:
+  Earliest delivered order by delivery_dt; tie-break by purchase_dt
+
+Repurchase definition:
+  Earliest subsequent order with purchase_dt > t0 and valid status
+"""
 
 
 def resolve_data_dir(explicit: str | None) -> Path:
@@ -38,6 +64,37 @@ def resolve_data_dir(explicit: str | None) -> Path:
     return (root / "raw_data").resolve()
 
 
+def write_cohort_csv(cohort: pd.DataFrame, path: Path) -> None:
+    """
+    Write the cohort CSV with pyarrow's multithreaded C++ writer.
+    
+    Timestamps are cast to whole seconds and rendered as TIMESTAMP_FORMAT;
+    categorical columns are written as their labels. Fields are unquoted, so
+    a value containing a delimiter raises instead of producing a broken file.
+    
+    Args:
+        cohort: One-row-per-customer cohort frame
+        path: Destination CSV path
+    """
+    table = pa.Table.from_pandas(cohort, preserve_index=False)
+    columns = []
+    for col in table.columns:
+        if pa.types.is_timestamp(col.type):
+            # timestamp[s] -> string renders as "%Y-%m-%d %H:%M:%S"
+            col = col.cast(pa.timestamp("s")).cast(pa.string())
+        elif pa.types.is_dictionary(col.type):
+            col = col.cast(pa.string())
+        columns.append(col)
+    table = pa.table(columns, names=table.column_names)
+
+    with open(path, "wb") as f:
+        # Header written unquoted to match the data rows
+        f.write((",".join(table.column_names) + "\n").encode("utf-8"))
+        pa_csv.write_csv(
+            table, f, pa_csv.WriteOptions(include_header=False, quoting_style="none")
+        )
+
+
 def main() -> None:
     """
     Build survival cohort with t0=index_order_delivery, event=first_repurchase.
@@ -71,39 +128,108 @@ def main() -> None:
         )
 
     print("=== BUILD SURVIVAL COHORT ===\n")
-    orders = pd.read_csv(orders_f)
-    customers = pd.read_csv(customers_f)
+    # Load only the columns used downstream; timestamps stay as strings and
+    # are parsed explicitly below. The two files are independent, so they are
+    # read concurrently (the C parser releases the GIL while tokenizing).
+    # The pyarrow engine is avoided: it infers types first and applies dtype=
+    # afterwards, so timestamps and digit-only ids would not arrive as raw strings.
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        orders_job = pool.submit(
+            pd.read_csv,
+            orders_f,
+            usecols=[
+                "order_id",
+                "customer_id",
+                "order_status",
+                "order_purchase_timestamp",
+                "order_delivered_customer_date",
+            ],
+            dtype={
+                "order_id": ID_DTYPE,
+                "customer_id": ID_DTYPE,
+                "order_status": "category",
+                "order_purchase_timestamp": "string",
+                "order_delivered_customer_date": "string",
+            },
+        )
+        customers_job = pool.submit(
+            pd.read_csv,
+            customers_f,
+            usecols=["customer_id", "customer_unique_id"],
+            dtype={"customer_id": ID_DTYPE, "customer_unique_id": ID_DTYPE},
+        )
+        orders, customers = orders_job.result(), customers_job.result()
 
-    # Parse timestamps
-    orders["purchase_dt"] = pd.to_datetime(orders["order_purchase_timestamp"], errors="coerce")
-    orders["delivery_dt"] = pd.to_datetime(orders["order_delivered_customer_date"], errors="coerce")
+    # Parse timestamps (Olist exports use a single fixed format; cache=True
+    # converts each distinct timestamp string only once)
+    orders["purchase_dt"] = pd.to_datetime(
+        orders["order_purchase_timestamp"], format=TIMESTAMP_FORMAT, errors="coerce", cache=True
+    )
+    orders["delivery_dt"] = pd.to_datetime(
+        orders["order_delivered_customer_date"], format=TIMESTAMP_FORMAT, errors="coerce", cache=True
+    )
+    # Raw timestamp strings are no longer needed; drop them in place so every
+    # downstream filter/merge/groupby carries fewer columns
+    del orders["order_purchase_timestamp"], orders["order_delivered_customer_date"]
 
     # CRITICAL: Snapshot computed from RAW orders before any filtering
     # This establishes administrative censoring boundary for entire cohort
-    snapshot_ts = orders["purchase_dt"].max()
+    # (plain int64 max over the non-NaT nanosecond values; NaT if none parse)
+    purchase_all = orders["purchase_dt"].to_numpy("datetime64[ns]")
+    purchase_all = purchase_all[~np.isnat(purchase_all)]
+    snapshot_ts = (
+        pd.Timestamp(purchase_all.view("i8").max(), unit="ns")
+        if purchase_all.size
+        else pd.NaT
+    )
     print(f"Dataset snapshot (max purchase_dt from raw orders): {snapshot_ts}")
 
+    # Keep only orders usable as index or repurchase orders before joining:
+    # both require a purchase timestamp and a valid (non-excluded) status
+    excluded_statuses = {"canceled", "unavailable"}
+    # order_status is categorical: compare integer codes (missing status = -1)
+    status_codes = orders["order_status"].cat.codes.to_numpy()
+    status_cats = orders["order_status"].cat.categories
+    excluded_codes = np.array(
+        [status_cats.get_loc(s) for s in excluded_statuses if s in status_cats],
+        dtype=status_codes.dtype,
+    )
+    valid_status_mask = (status_codes != -1) & ~np.isin(status_codes, excluded_codes)
+    orders = orders[orders["purchase_dt"].notna() & valid_status_mask]
+
     # Join customer unique ID for longitudinal tracking
     orders = orders.merge(
         customers[["customer_id", "customer_unique_id"]], 
         on="customer_id", 
-        how="inner"
+        how="inner",
+        validate="m:1",
     )
+    # Categorical key: downstream groupbys and lookups hash int codes, not strings
+    orders["customer_unique_id"] = orders["customer_unique_id"].astype("category")
 
     # ─── INDEX ORDER CONSTRUCTION ───
     # t0 = delivery timestamp of first delivered order
-    delivered = orders[
-        (orders["order_status"] == "delivered")
-        & orders["delivery_dt"].notna()
-        & orders["purchase_dt"].notna()
-    ].copy()
-
-    # Deterministic tie-breaking ensures reproducibility
-    delivered = delivered.sort_values(
-        ["customer_unique_id", "delivery_dt", "purchase_dt"]
+    # (purchase_dt is already non-null after the pre-merge filter)
+    delivery_ns = orders["delivery_dt"].to_numpy("datetime64[ns]")
+    purchase_ns = orders["purchase_dt"].to_numpy("datetime64[ns]")
+    cu_codes = orders["customer_unique_id"].cat.codes.to_numpy()
+    # Null customer_unique_id (code -1) is not a customer, as groupby drops NaN keys
+    delivered_pos = np.flatnonzero(
+        (orders["order_status"] == "delivered").to_numpy()
+        & ~np.isnat(delivery_ns)
+        & (cu_codes != -1)
+    )
+
+    # Deterministic tie-breaking ensures reproducibility: stable lexsort by
+    # (customer, delivery_dt, purchase_dt), then keep the first row per customer
+    order = np.lexsort(
+        (purchase_ns[delivered_pos], delivery_ns[delivered_pos], cu_codes[delivered_pos])
     )
-    index_orders = delivered.groupby("customer_unique_id", as_index=False).first()
-    index_orders = index_orders.rename(
+    sorted_codes = cu_codes[delivered_pos][order]
+    is_first = np.ones(len(sorted_codes), dtype=bool)
+    is_first[1:] = sorted_codes[1:] != sorted_codes[:-1]
+    index_pos = delivered_pos[order[is_first]]
+    index_orders = orders.iloc[index_pos].rename(
         columns={
             "order_id": "index_order_id",
             "purchase_dt": "p0",
@@ -114,27 +240,28 @@ def main() -> None:
     print(f"Customers with delivered index order: {len(index_orders):,}")
 
     # ─── REPURCHASE EVENT CONSTRUCTION ───
-    # Event = first VALID order with purchase_dt > t0
-    excluded_statuses = {"canceled", "unavailable"}
-    valid_status_mask = (
-        orders["order_status"].notna() 
-        & ~orders["order_status"].isin(excluded_statuses)
-    )
-
-    candidates = orders.loc[valid_status_mask].merge(
-        index_orders[["customer_unique_id", "t0"]],
-        on="customer_unique_id",
-        how="inner",
+    # Event = first VALID order with purchase_dt > t0 (orders is pre-filtered)
+    # t0 is a per-customer lookup, so index it by category code rather than
+    # joining; customers without a delivered index order get NaT and drop out
+    # below. The extra trailing NaT slot is what a missing key (code -1) reads.
+    t0_by_code = np.full(
+        len(orders["customer_unique_id"].cat.categories) + 1,
+        np.datetime64("NaT"),
+        dtype="datetime64[ns]",
     )
+    t0_by_code[cu_codes[index_pos]] = delivery_ns[index_pos]
+    candidates = orders.assign(t0=t0_by_code[cu_codes])
     # Temporal leakage prevention: only orders AFTER t0
     candidates = candidates[
-        candidates["purchase_dt"].notna() 
+        candidates["t0"].notna()
         & (candidates["purchase_dt"] > candidates["t0"])
-    ].copy()
+    ]
 
-    candidates = candidates.sort_values(["customer_unique_id", "purchase_dt"])
-    first_rep = candidates.groupby("customer_unique_id", as_index=False).first()
-    first_rep = first_rep.rename(
+    # Earliest post-t0 order per customer in one grouped pass (no full sort)
+    first_idx = candidates.groupby(
+        "customer_unique_id", observed=True
+    )["purchase_dt"].idxmin()
+    first_rep = candidates.loc[first_idx].rename(
         columns={
             "order_id": "repurchase_order_id",
             "purchase_dt": "p1",
@@ -143,31 +270,48 @@ def main() -> None:
     )[["customer_unique_id", "repurchase_order_id", "p1", "repurchase_order_status"]]
 
     # ─── SURVIVAL OUTCOME ASSEMBLY ───
-    cohort = index_orders.merge(first_rep, on="customer_unique_id", how="left")
-    cohort["event"] = cohort["p1"].notna().astype(int)
-
-    # Duration: t0->p1 for events, t0->snapshot for administrative censoring
-    cohort["duration_days"] = np.where(
-        cohort["event"].eq(1),
-        (cohort["p1"] - cohort["t0"]).dt.total_seconds() / 86400.0,
-        (snapshot_ts - cohort["t0"]).dt.total_seconds() / 86400.0,
+    # Both sides are one row per customer: align on the index instead of merging
+    cohort = (
+        index_orders.set_index("customer_unique_id")
+        .join(first_rep.set_index("customer_unique_id"), how="left", validate="1:1")
+        .reset_index()
     )
 
-    cohort = cohort[
-        cohort["duration_days"].notna() & (cohort["duration_days"] >= 0)
-    ].copy()
+    # Event flag, duration and diagnostics in one pass over numpy arrays.
+    # Duration: t0->p1 for events, t0->snapshot for administrative censoring,
+    # computed on int64 nanoseconds to avoid materializing Timedelta columns.
+    t0_dt = cohort["t0"].to_numpy("datetime64[ns]")
+    p1_dt = cohort["p1"].to_numpy("datetime64[ns]")
+    t0_ns = t0_dt.view("i8")
+    p1_ns = p1_dt.view("i8")
+    snap_ns = np.int64(pd.Timestamp(snapshot_ts).value)
+    event = ~np.isnat(p1_dt)
+    # p1 is NaT exactly when censored, so fill it with the snapshot and
+    # subtract once
+    end_ns = np.where(event, p1_ns, snap_ns)
+    duration_days = (end_ns - t0_ns) / NS_PER_DAY
+    valid = ~np.isnat(t0_dt) & (duration_days >= 0)
 
+    n_valid = int(valid.sum())
+    event_sum = int(event[valid].sum())
+    within_24h_sum = int((event & (duration_days <= 1.0))[valid].sum())
+    # Empty cohort: report NaN rates (as a mean over no rows would)
+    event_rate = event_sum / n_valid if n_valid else float("nan")
     # Diagnostic: monitor same-day repurchases (quality check)
-    within_24h = cohort["event"].eq(1) & (cohort["duration_days"] <= 1.0)
-    pct_within_24h = within_24h.mean() * 100
+    pct_within_24h = within_24h_sum / n_valid * 100 if n_valid else float("nan")
+
+    cohort["event"] = event.astype(int)
+    cohort["duration_days"] = duration_days
+    cohort = cohort[valid]
 
-    print(f"Event rate (any repurchase observed): {cohort['event'].mean():.2%}")
+    print(f"Event rate (any repurchase observed): {event_rate:.2%}")
     print(f"% of repurchases within 24h of t0 (diagnostic): {pct_within_24h:.2f}%")
 
-    if cohort["event"].sum() > 0:
+    if event_sum > 0:
+        # Categorical status: drop never-observed levels (e.g. excluded statuses)
         dist = cohort.loc[
             cohort["event"].eq(1), "repurchase_order_status"
-        ].value_counts(normalize=True)
+        ].cat.remove_unused_categories().value_counts(normalize=True)
         print("\nRepurchase order status distribution (event=1):")
         print(dist)
 
@@ -176,7 +320,7 @@ def main() -> None:
     
     # 1. Cohort CSV
     cohort_path = out_dir / "cohort_survival.csv"
-    cohort.to_csv(cohort_path, index=False)
+    write_cohort_csv(cohort, cohort_path)
     print(f"\n[OK] Saved: {cohort_path}")
     print(f"  Columns: {list(cohort.columns)}")
 
@@ -185,7 +329,7 @@ def main() -> None:
         "snapshot_ts": str(pd.Timestamp(snapshot_ts)),
         "customers_with_delivered_index_order": int(len(index_orders)),
         "cohort_rows": int(len(cohort)),
-        "event_rate_any_repurchase": float(cohort["event"].mean()),
+        "event_rate_any_repurchase": event_rate,
         "excluded_repurchase_statuses": sorted(excluded_statuses),
         "index_order_definition": "earliest delivered order by delivery_dt; tie-break by purchase_dt",
         "repurchase_definition": "earliest subsequent order with purchase_dt > t0 and valid status",
@@ -197,25 +341,15 @@ def main() -> None:
     print(f"[OK] Saved: {meta_path}")
 
     # 3. Human-readable summary
-    summary_lines = [
-        "SURVIVAL COHORT BUILD SUMMARY",
-        "=" * 50,
-        "",
-        f"Dataset snapshot (max purchase_dt): {pd.Timestamp(snapshot_ts)}",
-        f"Customers with delivered index order: {len(index_orders):,}",
-        f"Cohort rows (1 row per customer): {len(cohort):,}",
-        f"Event rate (any repurchase observed): {cohort['event'].mean():.2%}",
-        f"Excluded repurchase statuses: {', '.join(sorted(excluded_statuses))}",
-        "",
-        "Index order definition:",
-        "  Earliest delivered order by delivery_dt; tie-break by purchase_dt",
-        "",
-        "Repurchase definition:",
-        "  Earliest subsequent order with purchase_dt > t0 and valid status",
-        "",
-    ]
+    summary = SUMMARY_TEMPLATE.format(
+        snapshot_ts=pd.Timestamp(snapshot_ts),
+        n_index=len(index_orders),
+        n_cohort=len(cohort),
+        event_rate=event_rate,
+        excluded=", ".join(sorted(excluded_statuses)),
+    )
     summary_path = out_dir / "cohort_build_summary.txt"
-    summary_path.write_text("\n".join(summary_lines), encoding="utf-8")
+    summary_path.write_text(summary, encoding="utf-8")
     print(f"[OK] Saved: {summary_path}")
 
 